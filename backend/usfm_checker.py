@@ -1,29 +1,91 @@
 import sys
 
-from typing import Any, Mapping, Optional, Sequence, TypeVar
+from typing import IO, Any, Iterable, Iterator, Mapping, Optional, Sequence, TypeVar
+import hashlib
+import json
+import multiprocessing
 import os
+import pickle
+import queue
+import tempfile
+import threading
+from collections import deque
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter
+from enum import Enum
+from email.utils import formatdate
+from http import HTTPStatus
+from http.client import HTTPException
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from os.path import exists, join, sep, basename
 
 from document.domain import resource_lookup
 from document.config import settings
 from document.domain import parsing
+from document.domain.model import ResourceLookupDto
 from document.utils.file_utils import (
     delete_tree,
-    load_json_object,
     source_file_needs_update,
 )
 import urllib
-from urllib.request import urlopen
-from contextlib import closing
-from pathlib import Path
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from contextlib import closing, contextmanager
 import shutil
 
 
 from pydantic import HttpUrl
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
 
 T = TypeVar("T")
 
+# A unit of work for the checker: the language, book code, and USFM
+# resource type to check.
+CheckTask = tuple[tuple[str, str, bool], str, str]
+
+
+class UsfmAssetStatus(str, Enum):
+    """
+    The outcome of checking a USFM asset. The values are the events
+    logged for each outcome.
+    """
+
+    # TODO This is likely because the
+    # resource_lookup_dto.url attribute was None which is likely because another
+    # jsonpath needs to be added to find the URL in resource_lookup.usfm_resource_lookup
+    CONTENT_FILE_MISSING = "content_file is None"
+    HTML_MISSING = "html is None"
+    # TODO Start going through catalog of checks on
+    # scripture source to determine the issues and
+    # possibly fix them programmatically
+    HTML_TOO_SHORT = "len(html) <= 300"
+    PARSES = "parses to HTML fine"
+    PROVISIONING_FAILED = "provisioning failed"
+
+
+# Cloning is dominated by waiting on the remote Gitea server rather
+# than local CPU, so there can be more clone threads than cores. There
+# are never more of them than DEFAULT_MAX_PENDING_ASSETS though, see
+# main.
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Cloned repos can be large, e.g., 50 big repos can take up 25 GB, so
+# keep the number of them on disk at any one time small.
+DEFAULT_MAX_PENDING_ASSETS = 8
+
 # We'll want some code that systematically goes through all heart
 # language repos to:
 #
@@ -50,6 +112,47 @@ T = TypeVar("T")
 
 logger = settings.logger(__name__)
 
+# Parse workers are started while the clone threads are already
+# running, and forking a process that has threads can leave the child
+# holding locks that no thread will ever release, so start them from
+# a fork server (or by spawning where that is unavailable) instead.
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Serializes log writes so that records from concurrent threads and
+# worker processes don't interleave. Replaced by _init_logging with a
+# lock that can be shared with the parse workers.
+_log_lock: Any = threading.Lock()
+
+# Whether to log the full traceback of failures rather than a one
+# line summary. Most failing repos fail the same way so formatting
+# thousands of tracebacks is usually wasted work. Set by
+# _init_logging.
+_log_tracebacks = False
+
+# The names of the entries in each directory that assets live in, read
+# with one scandir per directory rather than one stat per asset, and
+# kept up to date as assets are provisioned and deleted.
+_existing_children: dict[str, set[str]] = {}
+_existing_children_lock = threading.Lock()
+# Notified whenever a scheduled delete finishes.
+_existing_children_changed = threading.Condition(_existing_children_lock)
+# The paths scheduled for deletion that haven't been deleted yet.
+_pending_deletes: set[str] = set()
+
+# The resource types and names for English and Indonesian come from
+# settings rather than translations.json so they can be computed once.
+_ENGLISH_RESOURCE_TYPES_AND_NAMES = tuple(settings.ENGLISH_RESOURCE_TYPE_MAP.items())
+_ID_RESOURCE_TYPES_AND_NAMES = tuple(settings.ID_RESOURCE_TYPE_MAP.items())
+
+# Directories of checked assets waiting to be deleted by the
+# background deletion thread, so that the checks don't wait on
+# deleting the previous asset's files.
+_delete_queue: "queue.Queue[str]" = queue.Queue()
+_delete_thread: Optional[threading.Thread] = None
+_delete_thread_lock = threading.Lock()
+
 
 def resource_types_and_names_for_heart_lang(
     lang_code: str,
@@ -69,74 +172,355 @@ def resource_types_and_names_for_heart_lang(
     drop-down menu or as an API method.
     """
     if lang_code == "en":
-        return [(key, value) for key, value in english_resource_type_map.items()]
+        if english_resource_type_map is settings.ENGLISH_RESOURCE_TYPE_MAP:
+            return _ENGLISH_RESOURCE_TYPES_AND_NAMES
+        return tuple(english_resource_type_map.items())
     if lang_code == "id":
-        return [(key, value) for key, value in id_resource_type_map.items()]
-    data = resource_lookup.fetch_source_data(
-        working_dir, str(translations_json_location)
-    )
-    for item in [lang for lang in data if lang["code"] == lang_code]:
-        values = [
-            (
-                resource_type["code"],
-                "{} ({})".format(
-                    resource_type["name"] if "name" in resource_type else "",
-                    resource_type["code"],
-                ),
+        if id_resource_type_map is settings.ID_RESOURCE_TYPE_MAP:
+            return _ID_RESOURCE_TYPES_AND_NAMES
+        return tuple(id_resource_type_map.items())
+    # Convert the arguments to hashable equivalents so that the
+    # result can be memoized.
+    return _resource_types_and_names_for_heart_lang(
+        lang_code,
+        working_dir,
+        str(translations_json_location),
+        frozenset(
+            chain(
+                usfm_resource_types,
+                tn_resource_types,
+                tq_resource_types,
+                tw_resource_types,
             )
-            for resource_type in item["contents"]
-            if (
-                resource_type["code"]
-                in [
-                    *usfm_resource_types,
-                    *tn_resource_types,
-                    *tq_resource_types,
-                    *tw_resource_types,
-                ]
-            )
-        ]
-    return sorted(values, key=lambda value: value[0])
+        ),
+    )
+
+
+@lru_cache(maxsize=None)
+def _resource_types_and_names_for_heart_lang(
+    lang_code: str,
+    working_dir: str,
+    translations_json_location: str,
+    allowed_resource_types: frozenset[str],
+) -> tuple[tuple[str, str], ...]:
+    item = _index_by_code(working_dir, translations_json_location).get(lang_code)
+    if item is None:
+        return ()
+    values = [
+        (code, f"{resource_type.get('name', '')} ({code})")
+        for resource_type in item["contents"]
+        if (code := resource_type["code"]) in allowed_resource_types
+    ]
+    return tuple(sorted(values, key=itemgetter(0)))
+
+
+@lru_cache(maxsize=None)
+def _index_by_code(working_dir: str, json_file_url: str) -> dict[str, Any]:
+    """
+    Index the languages in translations.json by language code. Loaded
+    at most once per process rather than once per language.
+    """
+    return _load_or_refresh_translations_index(working_dir, json_file_url)
+
+
+def _load_or_refresh_translations_index(
+    working_dir: str, json_file_url: str
+) -> dict[str, Any]:
+    """
+    Return the index of translations.json by language code, reusing
+    the index pickled by a previous run unless translations.json has
+    changed since. The pickle is signed with the SHA-256 digest of the
+    translations.json it was built from.
+    """
+    json_file_path = _maybe_refresh_translations(working_dir, json_file_url)
+    index_path = "{}.pickle".format(os.path.splitext(json_file_path)[0])
+    with open(json_file_path, "rb") as fin:
+        content = fin.read()
+    signature = hashlib.sha256(content).hexdigest()
+    if exists(index_path):
+        with open(index_path, "rb") as fin:
+            signed_index: tuple[str, dict[str, Any]] = pickle.load(fin)
+        if signed_index[0] == signature:
+            return signed_index[1]
+    index = {lang["code"]: lang for lang in _loads_json(content)}
+    with _write_atomically(index_path) as fout:
+        pickle.dump((signature, index), fout, protocol=pickle.HIGHEST_PROTOCOL)
+    return index
+
+
+def _loads_json(content: bytes) -> Any:
+    """
+    Parse JSON content, using orjson if it is installed since it parses
+    large files like translations.json several times faster than the
+    standard library.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _maybe_refresh_translations(
+    working_dir: str, json_file_url: str, buffer_size: int = 65536
+) -> str:
+    """
+    Download the JSON file at json_file_url into working_dir unless
+    the local copy is still fresh according to the asset caching
+    settings or the remote file hasn't changed since the local copy
+    was downloaded, and return the path of the local copy. The
+    download is streamed to disk in buffer_size chunks rather than
+    read into memory whole. If the remote file can't be reached, the
+    local copy is used as is.
+    """
+    json_file_path = join(working_dir, basename(json_file_url))
+    if not source_file_needs_update(json_file_path):
+        return json_file_path
+    etag_path = "{}.etag".format(os.path.splitext(json_file_path)[0])
+    request = Request(json_file_url)
+    # Only ask for the file if it has changed since it was downloaded,
+    # so that checking an unchanged file costs one round trip and no
+    # download.
+    if exists(json_file_path):
+        request.add_header(
+            "If-Modified-Since",
+            formatdate(os.path.getmtime(json_file_path), usegmt=True),
+        )
+        if exists(etag_path):
+            with open(etag_path) as fin:
+                request.add_header("If-None-Match", fin.read())
+    try:
+        with closing(urlopen(request)) as response:
+            with _write_atomically(json_file_path) as fout:
+                shutil.copyfileobj(response, fout, length=buffer_size)
+            etag = response.headers.get("ETag")
+    except (OSError, HTTPException) as exc:
+        if isinstance(exc, HTTPError) and exc.code == HTTPStatus.NOT_MODIFIED:
+            # The local copy is current, so it is fresh for another
+            # caching period.
+            os.utime(json_file_path)
+            return json_file_path
+        if not exists(json_file_path):
+            raise
+        _log_failure("Using the local copy of %s: %r", json_file_url, exc)
+        return json_file_path
+    if etag:
+        with open(etag_path, "w") as etag_file:
+            etag_file.write(etag)
+    elif exists(etag_path):
+        os.remove(etag_path)
+    return json_file_path
+
+
+@contextmanager
+def _write_atomically(file_path: str) -> Iterator[IO[bytes]]:
+    """
+    Yield a temporary file to write the new content of file_path to.
+    It replaces file_path once the with block completes, so that an
+    interrupted write never leaves a truncated file behind, and is
+    removed if the block fails.
+    """
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+    temp_file = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+    try:
+        with temp_file:
+            yield temp_file
+        os.replace(temp_file.name, file_path)
+    except BaseException:
+        os.unlink(temp_file.name)
+        raise
+
+
+def _init_logging(log_lock: Any, log_tracebacks: bool) -> None:
+    global _log_lock, _log_tracebacks
+    _log_lock = log_lock
+    _log_tracebacks = log_tracebacks
 
 
 def log_event(context: dict[str, T]) -> None:
-    logger.debug(context)
+    with _log_lock:
+        logger.debug(context)
+
+
+def _log_failure(message: str, *args: Any) -> None:
+    """
+    Log a warning about the exception being handled, including its
+    traceback only if tracebacks were asked for.
+    """
+    with _log_lock:
+        logger.warning(message, *args, exc_info=_log_tracebacks)
 
 
 def delete_asset(resource_dir: str, dir_to_preserve: str = "temp") -> None:
-    parent_dir = str(Path(resource_dir).parent.absolute())
-    if dir_to_preserve != Path(parent_dir).name:
-        delete_tree(parent_dir)
-    elif dir_to_preserve != Path(resource_dir).name:
-        delete_tree(resource_dir)
+    """
+    Schedule the asset's files for deletion in the background. Call
+    wait_for_deletes to wait for scheduled deletions to finish.
+    """
+    # abspath also drops any trailing separator, which would otherwise
+    # make basename return ''
+    resource_dir = os.path.abspath(resource_dir)
+    parent_dir = os.path.dirname(resource_dir)
+    if dir_to_preserve != basename(parent_dir):
+        _schedule_delete(parent_dir)
+    elif dir_to_preserve != basename(resource_dir):
+        _schedule_delete(resource_dir)
+
+
+def wait_for_deletes() -> None:
+    """
+    Wait for the deletions scheduled by delete_asset to finish.
+    """
+    _delete_queue.join()
+
+
+def _schedule_delete(path: str) -> None:
+    global _delete_thread
+    path = os.path.abspath(path)
+    with _delete_thread_lock:
+        if _delete_thread is None:
+            _delete_thread = threading.Thread(
+                target=_delete_worker, name="asset-deleter", daemon=True
+            )
+            _delete_thread.start()
+    # Queued deletes no longer count as existing, but checks of paths
+    # being deleted wait for the delete to finish, see
+    # _wait_for_pending_deletes.
+    with _existing_children_lock:
+        _pending_deletes.add(path)
+    _record_path(path, present=False)
+    _delete_queue.put(path)
+
+
+def _delete_worker() -> None:
+    while True:
+        path = _delete_queue.get()
+        try:
+            delete_tree(path)
+        except OSError:
+            with _log_lock:
+                logger.exception("Failed to delete %s", path)
+            _record_path(path, present=exists(path))
+        finally:
+            with _existing_children_lock:
+                _pending_deletes.discard(path)
+                _existing_children_changed.notify_all()
+            _delete_queue.task_done()
+
+
+def _claim_path(path: str) -> bool:
+    """
+    Atomically check whether path exists and, if it doesn't, record it
+    as existing so that no other thread provisions it too. Return
+    whether path was claimed.
+    """
+    path = os.path.abspath(path)
+    parent, name = os.path.split(path)
+    with _existing_children_lock:
+        _wait_for_pending_deletes(path)
+        children = _listing(parent)
+        if name in children:
+            return False
+        children.add(name)
+        return True
+
+
+def _wait_for_pending_deletes(path: str) -> None:
+    """
+    Wait for any scheduled deletes of path, the directories above it,
+    or anything below it to finish. Must be called with
+    _existing_children_lock held.
+    """
+    while any(
+        path == pending
+        or path.startswith(pending + sep)
+        or pending.startswith(path + sep)
+        for pending in _pending_deletes
+    ):
+        _existing_children_changed.wait()
+
+
+def _listing(parent: str) -> set[str]:
+    """
+    Return the names of the entries in parent, reading them on first
+    use. Must be called with _existing_children_lock held.
+    """
+    children = _existing_children.get(parent)
+    if children is None:
+        try:
+            with os.scandir(parent) as entries:
+                children = {entry.name for entry in entries}
+        except FileNotFoundError:
+            children = set()
+        _existing_children[parent] = children
+    return children
 
 
-def main() -> None:
+def _record_path(path: str, present: bool) -> None:
+    """
+    Update the listing of path's parent directory, if it has been read,
+    after path has been created or deleted. The listings of a deleted
+    path and the directories below it are forgotten.
+    """
+    path = os.path.abspath(path)
+    parent, name = os.path.split(path)
+    with _existing_children_lock:
+        if not present:
+            for listed in [
+                listed
+                for listed in _existing_children
+                if listed == path or listed.startswith(path + sep)
+            ]:
+                del _existing_children[listed]
+        children = _existing_children.get(parent)
+        if children is None:
+            return
+        if present:
+            children.add(name)
+        else:
+            children.discard(name)
+
+
+def main(
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    max_pending_assets: int = DEFAULT_MAX_PENDING_ASSETS,
+    log_tracebacks: bool = False,
+) -> None:
     """
     Check heart language USFM assets.
 
     Usage:
     >>> main()
     """
-    heart_lang_codes_and_names = [
+    # Generate the tasks lazily so that checking starts with the first
+    # language rather than after every language's books have been
+    # looked up. run_checks only pulls tasks as it has room for them.
+    heart_lang_codes_and_names = (
         lang_code_and_name
         for lang_code_and_name in resource_lookup.lang_codes_and_names()
         if not lang_code_and_name[2]
-    ]
-    for lang_code_and_name in heart_lang_codes_and_names:
-        usfm_check_for_lang(lang_code_and_name)
+    )
+    tasks = (
+        task
+        for lang_code_and_name in heart_lang_codes_and_names
+        for task in check_tasks_for_lang(lang_code_and_name)
+    )
+    with _parse_pool(log_tracebacks) as parse_pool:
+        # Each clone thread needs an asset in flight to clone, so any
+        # threads beyond max_pending_assets would sit idle.
+        with ThreadPoolExecutor(
+            max_workers=min(max_workers, max_pending_assets)
+        ) as clone_pool:
+            run_checks(tasks, clone_pool, parse_pool, max_pending_assets)
+    wait_for_deletes()
 
 
-def usfm_check_for_lang(
+def check_tasks_for_lang(
     lang_code_and_name: tuple[str, str, bool],
     usfm_resource_types: Sequence[str] = settings.USFM_RESOURCE_TYPES,
-) -> None:
+) -> list[CheckTask]:
     """
-    Check USFM for language
-
-    Usage:
-    >>> usfm_check_for_lang(("auh", "Aushi"))
+    Return a task for each book and USFM resource type available for
+    the language.
     """
-    # logger.debug("About to get data for language: %s", lang_code_and_name)
     # Could be more than one USFM type per language, e.g., ulb and f10
     usfm_resource_types_and_names = [
         resource_type_and_name
@@ -146,100 +530,292 @@ def usfm_check_for_lang(
         if resource_type_and_name[0] in usfm_resource_types
     ]
     book_codes = resource_lookup.book_codes_for_lang(lang_code_and_name[0])
-    for book_code in book_codes:
-        for usfm_resource_type_and_name in usfm_resource_types_and_names:
-            # FIXME usfm_resource_lookup uses translations.json to find lookup info.
-            # Bear in mind that if we are working with mirrored repos that are not
-            # in translations.json this is a chicken before the egg situation.
-            # However, if we find the issue in the repo pointed to by
-            # translations.json then we can subsequently lookup its mirrored repo
-            # using some reliable URL naming pattern and make changes on the
-            # mirrored repo.
-            resource_lookup_dto = resource_lookup.usfm_resource_lookup(
-                lang_code_and_name[0],
-                usfm_resource_type_and_name[0],
-                book_code[0],
-            )
-            # FIXME Some assets will not be git repos, for those that are zip files we can
-            # at least find issues. We would need to determine the git repo where
-            # the zips are coming from in order to see if that repo was mirrored so
-            # that we could clone and make changes there.
-            #
-            # Check if the resource has already been checked and only proceed for
-            # this resource if resource_dir does not physically exist. This makes
-            # usfm_checker restartable, which is nice since it checks a LOT of
-            # repos.
-            resource_dir = resource_lookup.resource_directory(
-                resource_lookup_dto.lang_code,
-                resource_lookup_dto.book_code,
-                resource_lookup_dto.resource_type,
+    return [
+        (lang_code_and_name, book_code[0], usfm_resource_type_and_name[0])
+        for book_code in book_codes
+        for usfm_resource_type_and_name in usfm_resource_types_and_names
+    ]
+
+
+def usfm_check_for_lang(
+    lang_code_and_name: tuple[str, str, bool],
+    usfm_resource_types: Sequence[str] = settings.USFM_RESOURCE_TYPES,
+    log_tracebacks: bool = False,
+) -> None:
+    """
+    Check USFM for language
+
+    Usage:
+    >>> usfm_check_for_lang(("auh", "Aushi"))
+    """
+    # logger.debug("About to get data for language: %s", lang_code_and_name)
+    with _parse_pool(log_tracebacks) as parse_pool:
+        with ThreadPoolExecutor(max_workers=4) as clone_pool:
+            run_checks(
+                check_tasks_for_lang(lang_code_and_name, usfm_resource_types),
+                clone_pool,
+                parse_pool,
             )
-            if exists(resource_dir):
+    wait_for_deletes()
+
+
+def _parse_pool(log_tracebacks: bool) -> ProcessPoolExecutor:
+    """
+    Return a pool of parse worker processes that log like this process
+    does.
+    """
+    log_lock = _MP_CONTEXT.Lock()
+    _init_logging(log_lock, log_tracebacks)
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=_MP_CONTEXT,
+        initializer=_init_logging,
+        initargs=(log_lock, log_tracebacks),
+    )
+
+
+def run_checks(
+    tasks: Iterable[CheckTask],
+    clone_pool: Executor,
+    parse_pool: Executor,
+    max_pending_assets: int = DEFAULT_MAX_PENDING_ASSETS,
+) -> None:
+    """
+    Check each task as a two stage pipeline: assets are provisioned
+    (network bound git clones) in clone_pool and handed off to
+    parse_pool (CPU bound) as soon as they are ready, so that while
+    one book is parsing the next ones are already cloning.
+
+    At most max_pending_assets assets are in flight, i.e., cloning,
+    cloned or parsing, at any one time. This caps the disk space used
+    by cloned repos that are waiting their turn to be parsed.
+    """
+    task_iter = iter(tasks)
+    # Map each clone future to the resource directory of its task
+    clone_futures: dict[Future[Optional[tuple[ResourceLookupDto, str]]], str] = {}
+    # Map each parse future to the asset it is parsing and the resource
+    # directory of its task
+    parse_futures: dict[
+        Future[tuple[Optional[str], UsfmAssetStatus]],
+        tuple[ResourceLookupDto, str, str],
+    ] = {}
+    # Several tasks can share a resource directory, e.g., all the books
+    # of a language's resource type are provisioned into the same one.
+    # Those tasks must run one after another, as they would serially,
+    # so map each resource directory that has a task in flight to the
+    # tasks waiting their turn for it.
+    waiting_tasks: dict[str, deque[CheckTask]] = {}
+
+    def submit_clone(task: CheckTask, resource_dir: str) -> None:
+        clone_futures[clone_pool.submit(_provision_asset, task)] = resource_dir
+
+    def release(resource_dir: str) -> None:
+        if waiting_tasks[resource_dir]:
+            submit_clone(waiting_tasks[resource_dir].popleft(), resource_dir)
+        else:
+            del waiting_tasks[resource_dir]
+
+    tasks_remain = True
+    while True:
+        while (
+            tasks_remain
+            and len(clone_futures) + len(parse_futures) < max_pending_assets
+        ):
+            task = next(task_iter, None)
+            if task is None:
+                tasks_remain = False
                 continue
-            resource_dir = resource_lookup.provision_asset_files(resource_lookup_dto)
-            content_file = None
-            html: Optional[str] = None
-            try:
-                content_file = parsing.usfm_asset_file(
-                    resource_lookup_dto, resource_dir
-                )
-                html = parsing.usfm_asset_html(content_file, resource_lookup_dto)
-            except:
-                logger.exception("Failed due to the following exception")
-            if not content_file:
-                # TODO This is likely because the
-                # resource_lookup_dto.url attribute was None which is likely because another
-                # jsonpath needs to be added to find the URL in resource_lookup.usfm_resource_lookup
-                log_event(
-                    {
-                        "event": "content_file is None",
-                        "resource_lookup_dto": resource_lookup_dto,
-                        "content_file": content_file,
-                        "resource_dir": resource_dir,
-                    }
-                )
-            elif not html:
-                log_event(
-                    {
-                        "event": "html is None",
-                        "resource_lookup_dto": resource_lookup_dto,
-                        "content_file": content_file,
-                        "resource_dir": resource_dir,
-                    }
-                )
-            elif html and not len(html) > 300:
-                # TODO Start going through catalog of checks on
-                # scripture source to determine the issues and
-                # possibly fix them programmatically
-                log_event(
-                    {
-                        "event": "len(html) <= 300",
-                        "resource_lookup_dto": resource_lookup_dto,
-                        "content_file": content_file,
-                        "resource_dir": resource_dir,
-                    }
-                )
-                # TODO Possibly Add the removal of repo
+            resource_dir = _task_resource_dir(task)
+            if resource_dir in waiting_tasks:
+                waiting_tasks[resource_dir].append(task)
+            else:
+                waiting_tasks[resource_dir] = deque()
+                submit_clone(task, resource_dir)
+        if not clone_futures and not parse_futures:
+            break
+        pending: set[Future[Any]] = {*clone_futures, *parse_futures}
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future in clone_futures:
+                resource_dir = clone_futures.pop(future)
+                provisioned = future.result()
+                if provisioned:
+                    parse_future = parse_pool.submit(_parse_asset, *provisioned)
+                    parse_futures[parse_future] = (*provisioned, resource_dir)
+                else:
+                    release(resource_dir)
             else:
-                log_event(
-                    {
-                        "event": "parses to HTML fine",
-                        "resource_lookup_dto": resource_lookup_dto,
-                        "content_file": content_file,
-                        "resource_dir": resource_dir,
-                    }
+                resource_lookup_dto, provisioned_dir, resource_dir = parse_futures.pop(
+                    future
                 )
-                # We can delete the resource directory of the
-                # successfully parsed resource to conserve space
-                delete_asset(resource_dir)
+                content_file, status = future.result()
+                _log_result(resource_lookup_dto, provisioned_dir, content_file, status)
+                release(resource_dir)
+
+
+def _task_resource_dir(task: CheckTask) -> str:
+    """
+    Return the directory the task's asset is provisioned into.
+    resource_directory only needs the task's own values so this is
+    cheap.
+    """
+    lang_code_and_name, book_code, resource_type = task
+    return resource_lookup.resource_directory(
+        lang_code_and_name[0], book_code, resource_type
+    )
+
+
+def _provision_asset(task: CheckTask) -> Optional[tuple[ResourceLookupDto, str]]:
+    """
+    Provision the asset files for the task and return the resource
+    lookup DTO along with the directory they were provisioned to, or
+    None if the asset has already been checked or could not be
+    provisioned, in which case the failure is logged.
+    """
+    lang_code_and_name, book_code, resource_type = task
+    # Check if the resource has already been checked and only proceed for
+    # this resource if resource_dir does not physically exist. This makes
+    # usfm_checker restartable, which is nice since it checks a LOT of
+    # repos. We can check this before paying for the resource lookup
+    # below. The check also claims resource_dir so that no other thread
+    # provisions it at the same time.
+    resource_dir = _task_resource_dir(task)
+    if not _claim_path(resource_dir):
+        return None
+    resource_lookup_dto: Optional[ResourceLookupDto] = None
+    try:
+        # FIXME usfm_resource_lookup uses translations.json to find lookup info.
+        # Bear in mind that if we are working with mirrored repos that are not
+        # in translations.json this is a chicken before the egg situation.
+        # However, if we find the issue in the repo pointed to by
+        # translations.json then we can subsequently lookup its mirrored repo
+        # using some reliable URL naming pattern and make changes on the
+        # mirrored repo.
+        resource_lookup_dto = resource_lookup.usfm_resource_lookup(
+            lang_code_and_name[0],
+            resource_type,
+            book_code,
+        )
+        # FIXME Some assets will not be git repos, for those that are zip files we
+        # can at least find issues. We would need to determine the git repo where
+        # the zips are coming from in order to see if that repo was mirrored so
+        # that we could clone and make changes there.
+        provisioned_dir = resource_lookup.provision_asset_files(resource_lookup_dto)
+    except Exception as exc:
+        # One repo failing to clone shouldn't stop the checks of the
+        # others.
+        _log_failure("Provisioning failed for %s: %r", task, exc)
+        log_event(
+            {
+                "event": UsfmAssetStatus.PROVISIONING_FAILED.value,
+                "task": task,
+                "resource_lookup_dto": resource_lookup_dto,
+                "resource_dir": resource_dir,
+            }
+        )
+        # Whatever a failed clone left behind counts as checked, just as
+        # it would on a restart.
+        _record_path(resource_dir, present=exists(resource_dir))
+        return None
+    return resource_lookup_dto, provisioned_dir
+
+
+def _parse_asset(
+    resource_lookup_dto: ResourceLookupDto,
+    resource_dir: str,
+    min_html_size: int = 300,
+) -> tuple[Optional[str], UsfmAssetStatus]:
+    """
+    Parse the provisioned USFM asset and return its content file, None
+    if parsing did not get that far, and the status of the check. Only
+    the status is returned rather than the HTML since that is all the
+    checks need, which saves pickling the HTML back from the worker
+    process. Defined at module level so that it can be pickled and
+    sent to a worker process.
+    """
+    content_file = None
+    html_size = 0
+    try:
+        content_file = parsing.usfm_asset_file(resource_lookup_dto, resource_dir)
+        html_size = len(
+            parsing.usfm_asset_html(content_file, resource_lookup_dto) or ""
+        )
+    except Exception as exc:
+        # KeyboardInterrupt and SystemExit are let through so that the
+        # checker can still be stopped.
+        _log_failure("Parsing failed for %s: %r", resource_lookup_dto.lang_code, exc)
+    if not content_file:
+        return content_file, UsfmAssetStatus.CONTENT_FILE_MISSING
+    if not html_size:
+        return content_file, UsfmAssetStatus.HTML_MISSING
+    if not html_size > min_html_size:
+        return content_file, UsfmAssetStatus.HTML_TOO_SHORT
+    return content_file, UsfmAssetStatus.PARSES
+
+
+def _log_result(
+    resource_lookup_dto: ResourceLookupDto,
+    resource_dir: str,
+    content_file: Optional[str],
+    status: UsfmAssetStatus,
+) -> None:
+    log_event(
+        {
+            "event": status.value,
+            "resource_lookup_dto": resource_lookup_dto,
+            "content_file": content_file,
+            "resource_dir": resource_dir,
+        }
+    )
+    # TODO Possibly Add the removal of repo for the other statuses
+    if status is UsfmAssetStatus.PARSES:
+        # We can delete the resource directory of the
+        # successfully parsed resource to conserve space
+        delete_asset(resource_dir)
 
 
 if __name__ == "__main__":
 
-    # To run the doctests in the this module, in the root of the project do:
-    # FROM_EMAIL_ADDRESS=... python backend/usfm_checker.py
+    # To run the checker, in the root of the project do:
+    # FROM_EMAIL_ADDRESS=... python backend/usfm_checker.py --jobs 16
+    # To run the doctests in the this module instead, pass --doctest.
     # See https://docs.python.org/3/library/doctest.html
     # for more details.
+    import argparse
     import doctest
 
-    doctest.testmod()
+    parser = argparse.ArgumentParser(description="Check heart language USFM assets.")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help=(
+            "Number of concurrent git clones, at most --max-pending-assets "
+            "(default: %(default)s)"
+        ),
+    )
+    parser.add_argument(
+        "--max-pending-assets",
+        type=int,
+        default=DEFAULT_MAX_PENDING_ASSETS,
+        help="Maximum number of cloned repos on disk at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--tracebacks",
+        action="store_true",
+        help="Log the full traceback of each failure rather than a summary",
+    )
+    parser.add_argument(
+        "--doctest",
+        action="store_true",
+        help="Run this module's doctests instead of the checker",
+    )
+    args = parser.parse_args()
+    if args.doctest:
+        doctest.testmod()
+    else:
+        main(
+            max_workers=args.jobs,
+            max_pending_assets=args.max_pending_assets,
+            log_tracebacks=args.tracebacks,
+        )
@@ -0,0 +1,814 @@
+import io
+import os
+import pickle
+import threading
+from concurrent.futures import Executor, Future
+from types import SimpleNamespace
+from email.message import Message
+from typing import Any, Callable, Iterator, Optional
+from urllib.error import HTTPError, URLError
+
+import pytest
+
+import usfm_checker
+from usfm_checker import CheckTask, UsfmAssetStatus
+
+
+class DeferredExecutor(Executor):
+    """
+    Executor that only runs a submitted call when told to, so that
+    tests control the order in which futures complete.
+    """
+
+    def __init__(
+        self, submitted: Optional[list[Future[Any]]] = None, **kwargs: Any
+    ) -> None:
+        self.submitted = [] if submitted is None else submitted
+        self.kwargs = kwargs
+        self.calls: dict[Future[Any], Callable[[], Any]] = {}
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Any:
+        future: Future[Any] = Future()
+        self.calls[future] = lambda: fn(*args, **kwargs)
+        self.submitted.append(future)
+        return future
+
+    def run(self, future: Future[Any]) -> bool:
+        if future not in self.calls:
+            return False
+        future.set_result(self.calls.pop(future)())
+        return True
+
+
+@pytest.fixture(autouse=True)
+def reset_listings() -> Iterator[None]:
+    usfm_checker._existing_children.clear()
+    usfm_checker._pending_deletes.clear()
+    yield
+    usfm_checker.wait_for_deletes()
+    usfm_checker._existing_children.clear()
+
+
+@pytest.fixture
+def pools(monkeypatch: pytest.MonkeyPatch) -> tuple[DeferredExecutor, DeferredExecutor]:
+    """
+    Clone and parse pools that complete the oldest in flight future
+    each time run_checks waits, recording how many were in flight.
+    """
+    submitted: list[Future[Any]] = []
+    clone_pool, parse_pool = DeferredExecutor(submitted), DeferredExecutor(submitted)
+    in_flight: list[int] = []
+
+    def fake_wait(futures: Any, return_when: str) -> tuple[set[Any], set[Any]]:
+        futures = sorted(futures, key=submitted.index)
+        in_flight.append(len(futures))
+        future = futures[0]
+        assert clone_pool.run(future) or parse_pool.run(future)
+        return {future}, set(futures[1:])
+
+    monkeypatch.setattr(usfm_checker, "wait", fake_wait)
+    monkeypatch.setattr(
+        usfm_checker,
+        "_task_resource_dir",
+        lambda task: "/assets/{}_{}".format(task[0][0], task[2]),
+    )
+    clone_pool.in_flight = in_flight  # type: ignore
+    return clone_pool, parse_pool
+
+
+def make_tasks(
+    lang_code: str, book_codes: list[str], resource_type: str
+) -> list[CheckTask]:
+    return [
+        ((lang_code, lang_code, False), book_code, resource_type)
+        for book_code in book_codes
+    ]
+
+
+def fail(*args: Any, **kwargs: Any) -> Any:
+    raise AssertionError("should not be called")
+
+
+def test_main_starts_no_more_clone_threads_than_pending_assets(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    clone_pools: list[DeferredExecutor] = []
+
+    def fake_thread_pool_executor(**kwargs: Any) -> DeferredExecutor:
+        clone_pools.append(DeferredExecutor(**kwargs))
+        return clone_pools[-1]
+
+    monkeypatch.setattr(usfm_checker.resource_lookup, "lang_codes_and_names", list)
+    monkeypatch.setattr(
+        usfm_checker, "_parse_pool", lambda log_tracebacks: DeferredExecutor()
+    )
+    monkeypatch.setattr(usfm_checker, "ThreadPoolExecutor", fake_thread_pool_executor)
+    monkeypatch.setattr(usfm_checker, "run_checks", lambda *args: None)
+    usfm_checker.main(max_workers=32, max_pending_assets=8)
+    usfm_checker.main(max_workers=4, max_pending_assets=8)
+    assert [pool.kwargs["max_workers"] for pool in clone_pools] == [8, 4]
+
+
+def test_main_looks_up_heart_language_tasks_lazily(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    looked_up: list[str] = []
+    pulled: list[CheckTask] = []
+
+    def check_tasks_for_lang(
+        lang_code_and_name: tuple[str, str, bool],
+    ) -> list[CheckTask]:
+        looked_up.append(lang_code_and_name[0])
+        return make_tasks(lang_code_and_name[0], ["gen", "exo"], "ulb")
+
+    def run_checks(tasks: Iterator[CheckTask], *args: Any) -> None:
+        pulled.append(next(tasks))
+        # Only the first language has been looked up so far
+        assert looked_up == ["aa"]
+        pulled.extend(tasks)
+
+    monkeypatch.setattr(
+        usfm_checker.resource_lookup,
+        "lang_codes_and_names",
+        lambda: [("aa", "Afar", False), ("en", "English", True), ("bb", "Bb", False)],
+    )
+    monkeypatch.setattr(usfm_checker, "check_tasks_for_lang", check_tasks_for_lang)
+    monkeypatch.setattr(
+        usfm_checker, "_parse_pool", lambda log_tracebacks: DeferredExecutor()
+    )
+    monkeypatch.setattr(usfm_checker, "ThreadPoolExecutor", DeferredExecutor)
+    monkeypatch.setattr(usfm_checker, "run_checks", run_checks)
+    usfm_checker.main()
+    # Gateway languages are skipped
+    assert looked_up == ["aa", "bb"]
+    assert pulled == make_tasks("aa", ["gen", "exo"], "ulb") + make_tasks(
+        "bb", ["gen", "exo"], "ulb"
+    )
+
+
+def test_run_checks_caps_assets_in_flight(
+    monkeypatch: pytest.MonkeyPatch, pools: tuple[DeferredExecutor, DeferredExecutor]
+) -> None:
+    clone_pool, parse_pool = pools
+    logged: list[str] = []
+    monkeypatch.setattr(
+        usfm_checker,
+        "_provision_asset",
+        lambda task: (
+            SimpleNamespace(book_code=task[1]),
+            "/clones/{}".format(task[0][0]),
+        ),
+    )
+    monkeypatch.setattr(
+        usfm_checker,
+        "_parse_asset",
+        lambda dto, resource_dir: ("f", UsfmAssetStatus.PARSES),
+    )
+    monkeypatch.setattr(
+        usfm_checker,
+        "_log_result",
+        lambda dto, resource_dir, content_file, status: logged.append(dto.book_code),
+    )
+    tasks = [
+        task
+        for lang_code in ["a", "b", "c", "d", "e", "f", "g"]
+        for task in make_tasks(lang_code, ["gen"], "ulb")
+    ]
+    usfm_checker.run_checks(tasks, clone_pool, parse_pool, max_pending_assets=3)
+    assert len(logged) == 7
+    assert max(clone_pool.in_flight) == 3  # type: ignore
+
+
+def test_run_checks_skips_already_checked_assets(
+    monkeypatch: pytest.MonkeyPatch, pools: tuple[DeferredExecutor, DeferredExecutor]
+) -> None:
+    clone_pool, parse_pool = pools
+    parsed: list[str] = []
+
+    def fake_provision_asset(task: CheckTask) -> Optional[tuple[Any, str]]:
+        if task[1] in ["gen", "lev"]:
+            return None
+        return SimpleNamespace(book_code=task[1]), "/clones/{}".format(task[1])
+
+    def fake_parse_asset(dto: Any, resource_dir: str) -> tuple[str, UsfmAssetStatus]:
+        parsed.append(dto.book_code)
+        return "f", UsfmAssetStatus.PARSES
+
+    monkeypatch.setattr(usfm_checker, "_provision_asset", fake_provision_asset)
+    monkeypatch.setattr(usfm_checker, "_parse_asset", fake_parse_asset)
+    monkeypatch.setattr(usfm_checker, "log_event", lambda context: None)
+    usfm_checker.run_checks(
+        make_tasks("aa", ["gen", "exo", "lev", "num"], "ulb"), clone_pool, parse_pool
+    )
+    assert parsed == ["exo", "num"]
+
+
+def test_run_checks_logs_each_outcome_and_deletes_parsed_assets(
+    monkeypatch: pytest.MonkeyPatch, pools: tuple[DeferredExecutor, DeferredExecutor]
+) -> None:
+    clone_pool, parse_pool = pools
+    parse_results = {
+        "gen": (None, UsfmAssetStatus.CONTENT_FILE_MISSING),
+        "exo": ("f", UsfmAssetStatus.HTML_MISSING),
+        "lev": ("f", UsfmAssetStatus.HTML_TOO_SHORT),
+        "num": ("f", UsfmAssetStatus.PARSES),
+    }
+    events: list[tuple[str, str]] = []
+    deleted: list[str] = []
+    monkeypatch.setattr(
+        usfm_checker,
+        "_provision_asset",
+        lambda task: (SimpleNamespace(book_code=task[1]), "/clones/{}".format(task[1])),
+    )
+    monkeypatch.setattr(
+        usfm_checker,
+        "_parse_asset",
+        lambda dto, resource_dir: parse_results[dto.book_code],
+    )
+    monkeypatch.setattr(
+        usfm_checker,
+        "log_event",
+        lambda context: events.append(
+            (context["resource_lookup_dto"].book_code, context["event"])
+        ),
+    )
+    monkeypatch.setattr(usfm_checker, "delete_asset", deleted.append)
+    usfm_checker.run_checks(
+        make_tasks("aa", list(parse_results), "ulb"), clone_pool, parse_pool
+    )
+    assert events == [
+        ("gen", "content_file is None"),
+        ("exo", "html is None"),
+        ("lev", "len(html) <= 300"),
+        ("num", "parses to HTML fine"),
+    ]
+    assert deleted == ["/clones/num"]
+
+
+def test_run_checks_runs_tasks_sharing_a_resource_dir_one_at_a_time(
+    monkeypatch: pytest.MonkeyPatch, pools: tuple[DeferredExecutor, DeferredExecutor]
+) -> None:
+    clone_pool, parse_pool = pools
+    steps: list[tuple[str, str, str]] = []
+
+    def fake_provision_asset(task: CheckTask) -> tuple[Any, str]:
+        steps.append(("provision", task[2], task[1]))
+        return SimpleNamespace(book_code=task[1], resource_type=task[2]), "/clones"
+
+    def fake_log_result(
+        dto: Any, resource_dir: str, content_file: str, status: UsfmAssetStatus
+    ) -> None:
+        steps.append(("log", dto.resource_type, dto.book_code))
+
+    monkeypatch.setattr(usfm_checker, "_provision_asset", fake_provision_asset)
+    monkeypatch.setattr(
+        usfm_checker,
+        "_parse_asset",
+        lambda dto, resource_dir: ("f", UsfmAssetStatus.PARSES),
+    )
+    monkeypatch.setattr(usfm_checker, "_log_result", fake_log_result)
+    book_codes = ["gen", "exo", "lev"]
+    tasks = [
+        task
+        for book_code in book_codes
+        for resource_type in ["ulb", "f10"]
+        for task in make_tasks("aa", [book_code], resource_type)
+    ]
+    usfm_checker.run_checks(tasks, clone_pool, parse_pool)
+    for resource_type in ["ulb", "f10"]:
+        assert [
+            (step, book_code)
+            for step, resource_type_, book_code in steps
+            if resource_type_ == resource_type
+        ] == [
+            (step, book_code)
+            for book_code in book_codes
+            for step in ["provision", "log"]
+        ]
+    # Tasks for different resource directories still overlap
+    assert steps[:2] == [("provision", "ulb", "gen"), ("provision", "f10", "gen")]
+
+
+@pytest.fixture
+def lookup(monkeypatch: pytest.MonkeyPatch, tmp_path: Any) -> None:
+    """
+    Look assets up without translations.json and provision them into
+    tmp_path.
+    """
+    monkeypatch.setattr(
+        usfm_checker.resource_lookup,
+        "usfm_resource_lookup",
+        lambda lang_code, resource_type, book_code: SimpleNamespace(
+            lang_code=lang_code, book_code=book_code, resource_type=resource_type
+        ),
+    )
+    monkeypatch.setattr(
+        usfm_checker.resource_lookup,
+        "resource_directory",
+        lambda lang_code, book_code, resource_type: str(
+            tmp_path / "{}_{}".format(lang_code, resource_type)
+        ),
+    )
+
+
+def test_provision_asset_skips_already_checked_assets(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Any, lookup: None
+) -> None:
+    (tmp_path / "aa_ulb").mkdir()
+    # The resource lookup is skipped as well as provisioning
+    monkeypatch.setattr(usfm_checker.resource_lookup, "usfm_resource_lookup", fail)
+    monkeypatch.setattr(usfm_checker.resource_lookup, "provision_asset_files", fail)
+    assert usfm_checker._provision_asset(make_tasks("aa", ["gen"], "ulb")[0]) is None
+
+
+def test_provision_asset_logs_failures(
+    monkeypatch: pytest.MonkeyPatch, lookup: None
+) -> None:
+    events: list[dict[str, Any]] = []
+
+    def fail_to_clone(resource_lookup_dto: Any) -> str:
+        raise RuntimeError("git clone failed")
+
+    monkeypatch.setattr(
+        usfm_checker.resource_lookup, "provision_asset_files", fail_to_clone
+    )
+    monkeypatch.setattr(usfm_checker, "log_event", events.append)
+    task = make_tasks("aa", ["gen"], "ulb")[0]
+    assert usfm_checker._provision_asset(task) is None
+    assert [(event["event"], event["task"]) for event in events] == [
+        ("provisioning failed", task)
+    ]
+    # Nothing was left on disk so the asset can be tried again
+    assert usfm_checker._claim_path(events[0]["resource_dir"])
+
+
+def fail_to_parse(*args: Any) -> Any:
+    raise ValueError("bad USFM")
+
+
+@pytest.mark.parametrize(
+    "html, status",
+    [
+        (None, UsfmAssetStatus.HTML_MISSING),
+        ("", UsfmAssetStatus.HTML_MISSING),
+        ("x" * 300, UsfmAssetStatus.HTML_TOO_SHORT),
+        ("x" * 301, UsfmAssetStatus.PARSES),
+    ],
+)
+def test_parse_asset_reports_status(
+    monkeypatch: pytest.MonkeyPatch, html: Optional[str], status: UsfmAssetStatus
+) -> None:
+    monkeypatch.setattr(
+        usfm_checker.parsing, "usfm_asset_file", lambda dto, resource_dir: "aa.usfm"
+    )
+    monkeypatch.setattr(
+        usfm_checker.parsing, "usfm_asset_html", lambda content_file, dto: html
+    )
+    assert usfm_checker._parse_asset(
+        SimpleNamespace(lang_code="aa"), "/assets/aa_ulb"
+    ) == ("aa.usfm", status)
+
+
+def test_parse_asset_reports_missing_content_file(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(usfm_checker.parsing, "usfm_asset_file", fail_to_parse)
+    monkeypatch.setattr(usfm_checker.parsing, "usfm_asset_html", fail)
+    assert usfm_checker._parse_asset(
+        SimpleNamespace(lang_code="aa"), "/assets/aa_ulb"
+    ) == (None, UsfmAssetStatus.CONTENT_FILE_MISSING)
+
+
+@pytest.mark.parametrize("log_tracebacks", [False, True])
+def test_parse_asset_logs_failures(
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+    log_tracebacks: bool,
+) -> None:
+    monkeypatch.setattr(
+        usfm_checker.parsing, "usfm_asset_file", lambda dto, resource_dir: "aa.usfm"
+    )
+    monkeypatch.setattr(usfm_checker.parsing, "usfm_asset_html", fail_to_parse)
+    monkeypatch.setattr(usfm_checker, "_log_tracebacks", log_tracebacks)
+    assert usfm_checker._parse_asset(
+        SimpleNamespace(lang_code="aa"), "/assets/aa_ulb"
+    ) == ("aa.usfm", UsfmAssetStatus.HTML_MISSING)
+    [record] = caplog.records
+    assert record.getMessage() == "Parsing failed for aa: ValueError('bad USFM')"
+    # The traceback is only formatted when asked for
+    assert bool(record.exc_info) == log_tracebacks
+
+
+def test_parse_asset_lets_keyboard_interrupt_through(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def interrupt(dto: Any, resource_dir: str) -> str:
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(usfm_checker.parsing, "usfm_asset_file", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        usfm_checker._parse_asset(SimpleNamespace(lang_code="aa"), "/assets/aa_ulb")
+
+
+def test_claim_path_lists_parent_once(tmp_path: Any) -> None:
+    asset_dir = tmp_path / "aa_ulb"
+    asset_dir.mkdir()
+    assert not usfm_checker._claim_path(str(asset_dir))
+    assert usfm_checker._claim_path(str(tmp_path / "aa_f10"))
+    assert not usfm_checker._claim_path(str(tmp_path / "aa_f10"))
+    # The listing is not read again...
+    asset_dir.rmdir()
+    with usfm_checker._existing_children_lock:
+        assert usfm_checker._listing(str(tmp_path)) == {"aa_ulb", "aa_f10"}
+    assert not usfm_checker._claim_path(str(asset_dir))
+    # ...but is kept up to date by _record_path
+    usfm_checker._record_path(str(asset_dir), present=False)
+    assert usfm_checker._claim_path(str(asset_dir))
+
+
+def test_record_path_forgets_listings_below_deleted_path(tmp_path: Any) -> None:
+    (tmp_path / "aa_ulb" / "repo").mkdir(parents=True)
+    assert not usfm_checker._claim_path(str(tmp_path / "aa_ulb" / "repo"))
+    assert not usfm_checker._claim_path(str(tmp_path / "aa_ulb"))
+    usfm_checker._record_path(str(tmp_path / "aa_ulb"), present=False)
+    assert list(usfm_checker._existing_children) == [str(tmp_path)]
+
+
+def test_delete_asset_updates_listing(tmp_path: Any) -> None:
+    asset_dir = tmp_path / "temp" / "aa_ulb"
+    asset_dir.mkdir(parents=True)
+    assert not usfm_checker._claim_path(str(asset_dir))
+    usfm_checker.delete_asset(str(asset_dir))
+    usfm_checker.wait_for_deletes()
+    assert not asset_dir.exists()
+    assert usfm_checker._claim_path(str(asset_dir))
+
+
+@pytest.mark.parametrize(
+    "resource_dir, deleted",
+    [
+        ("temp/aa_ulb/repo", "temp/aa_ulb"),
+        ("temp/aa_ulb/repo/", "temp/aa_ulb"),
+        ("temp/aa_ulb", "temp/aa_ulb"),
+        ("temp/aa_ulb/", "temp/aa_ulb"),
+        ("temp/temp", None),
+    ],
+)
+def test_delete_asset_preserves_working_dir(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Any,
+    resource_dir: str,
+    deleted: Optional[str],
+) -> None:
+    scheduled: list[str] = []
+    monkeypatch.setattr(usfm_checker, "_schedule_delete", scheduled.append)
+    usfm_checker.delete_asset(os.path.join(str(tmp_path), resource_dir))
+    assert scheduled == ([str(tmp_path / deleted)] if deleted else [])
+
+
+def test_claims_wait_for_scheduled_deletes(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Any
+) -> None:
+    asset_dir = tmp_path / "aa_ulb"
+    (asset_dir / "repo").mkdir(parents=True)
+    assert not usfm_checker._claim_path(str(asset_dir))
+    delete_started, finish_delete = threading.Event(), threading.Event()
+    delete_tree = usfm_checker.delete_tree
+
+    def slow_delete_tree(path: str) -> None:
+        delete_started.set()
+        finish_delete.wait()
+        delete_tree(path)
+
+    monkeypatch.setattr(usfm_checker, "delete_tree", slow_delete_tree)
+    usfm_checker.delete_asset(str(asset_dir / "repo"))
+    delete_started.wait()
+    claimed: list[bool] = []
+    claimer = threading.Thread(
+        target=lambda: claimed.append(usfm_checker._claim_path(str(asset_dir)))
+    )
+    claimer.start()
+    claimer.join(timeout=0.2)
+    # The claim waits for the delete rather than seeing a stale listing
+    assert claimer.is_alive()
+    finish_delete.set()
+    claimer.join()
+    assert claimed == [True]
+    assert not asset_dir.exists()
+
+
+def test_failed_deletes_are_logged(
+    monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture, tmp_path: Any
+) -> None:
+    asset_dir = tmp_path / "aa_ulb"
+    (asset_dir / "repo").mkdir(parents=True)
+
+    def fail_to_delete(path: str) -> None:
+        raise PermissionError(path)
+
+    monkeypatch.setattr(usfm_checker, "delete_tree", fail_to_delete)
+    usfm_checker.delete_asset(str(asset_dir / "repo"))
+    usfm_checker.wait_for_deletes()
+    assert "Failed to delete {}".format(asset_dir) in caplog.messages
+    # The asset is still there, so it must not be provisioned again
+    assert not usfm_checker._claim_path(str(asset_dir))
+
+
+@pytest.fixture
+def fetches(monkeypatch: pytest.MonkeyPatch) -> Iterator[list[str]]:
+    """
+    Serve a small translations.json index, recording the URL of each
+    load, with the resource type caches cleared.
+    """
+    fetched: list[str] = []
+    languages = [
+        {
+            "code": "aa",
+            "contents": [{"code": "ulb", "name": "ULB"}, {"code": "tn", "name": "TN"}],
+        },
+        {"code": "bb", "contents": [{"code": "ulb", "name": "ULB"}]},
+    ]
+
+    def fake_load_index(working_dir: str, json_file_url: str) -> dict[str, Any]:
+        fetched.append(json_file_url)
+        return {lang["code"]: lang for lang in languages}
+
+    monkeypatch.setattr(
+        usfm_checker, "_load_or_refresh_translations_index", fake_load_index
+    )
+    usfm_checker._resource_types_and_names_for_heart_lang.cache_clear()
+    usfm_checker._index_by_code.cache_clear()
+    yield fetched
+    usfm_checker._resource_types_and_names_for_heart_lang.cache_clear()
+    usfm_checker._index_by_code.cache_clear()
+
+
+def test_resource_types_and_names_for_heart_lang_is_memoized(
+    fetches: list[str],
+) -> None:
+    resource_types_and_names = usfm_checker.resource_types_and_names_for_heart_lang
+    assert resource_types_and_names("aa") == (("tn", "TN (tn)"), ("ulb", "ULB (ulb)"))
+    assert resource_types_and_names("aa") is resource_types_and_names("aa")
+    assert resource_types_and_names("bb") == (("ulb", "ULB (ulb)"),)
+    # translations.json is fetched once rather than once per language
+    assert len(fetches) == 1
+
+
+def test_resource_types_and_names_for_heart_lang_honours_arguments(
+    fetches: list[str],
+) -> None:
+    resource_types_and_names = usfm_checker.resource_types_and_names_for_heart_lang
+    assert resource_types_and_names("en", english_resource_type_map={"a": "A"}) == (
+        ("a", "A"),
+    )
+    assert resource_types_and_names("aa", tn_resource_types=[]) == (
+        ("ulb", "ULB (ulb)"),
+    )
+
+
+def test_resource_types_and_names_for_english_and_indonesian(
+    fetches: list[str],
+) -> None:
+    resource_types_and_names = usfm_checker.resource_types_and_names_for_heart_lang
+    # The defaults are converted once, at import
+    assert (
+        resource_types_and_names("en") is usfm_checker._ENGLISH_RESOURCE_TYPES_AND_NAMES
+    )
+    assert resource_types_and_names("id") is usfm_checker._ID_RESOURCE_TYPES_AND_NAMES
+    assert resource_types_and_names("en") == tuple(
+        usfm_checker.settings.ENGLISH_RESOURCE_TYPE_MAP.items()
+    )
+    # ...but overridden maps are still used
+    assert resource_types_and_names("id", id_resource_type_map={"b": "B"}) == (
+        ("b", "B"),
+    )
+    # translations.json isn't needed for either
+    assert fetches == []
+
+
+@pytest.fixture
+def index(monkeypatch: pytest.MonkeyPatch) -> Iterator[dict[str, Any]]:
+    """
+    Index of translations.json by language code to look resource types
+    up in, with the resource type cache cleared.
+    """
+    languages: dict[str, Any] = {}
+    monkeypatch.setattr(
+        usfm_checker, "_index_by_code", lambda working_dir, json_file_url: languages
+    )
+    usfm_checker._resource_types_and_names_for_heart_lang.cache_clear()
+    yield languages
+    usfm_checker._resource_types_and_names_for_heart_lang.cache_clear()
+
+
+def test_resource_types_and_names_for_unknown_lang_code(index: dict[str, Any]) -> None:
+    index["aa"] = {"code": "aa", "contents": [{"code": "ulb", "name": "ULB"}]}
+    assert usfm_checker.resource_types_and_names_for_heart_lang("zz") == ()
+
+
+def test_resource_types_and_names_for_heart_lang_filters_resource_types(
+    index: dict[str, Any],
+) -> None:
+    index["aa"] = {
+        "code": "aa",
+        "contents": [
+            {"code": "ulb", "name": "ULB"},
+            {"code": "obs", "name": "Open Bible Stories"},
+            {"code": "tq"},
+        ],
+    }
+    assert usfm_checker.resource_types_and_names_for_heart_lang("aa") == (
+        ("tq", " (tq)"),
+        ("ulb", "ULB (ulb)"),
+    )
+
+
+def test_resource_types_and_names_for_heart_lang_sorts_by_code(
+    index: dict[str, Any],
+) -> None:
+    index["aa"] = {
+        "code": "aa",
+        "contents": [
+            {"code": "ulb", "name": "A"},
+            {"code": "tw", "name": "B"},
+            {"code": "f10", "name": "C"},
+            {"code": "tn", "name": "D"},
+        ],
+    }
+    assert [
+        code
+        for code, name in usfm_checker.resource_types_and_names_for_heart_lang("aa")
+    ] == ["f10", "tn", "tw", "ulb"]
+
+
+class FakeResponse(io.BytesIO):
+    def __init__(self, content: bytes, headers: dict[str, str]) -> None:
+        super().__init__(content)
+        self.headers = headers
+
+
+@pytest.fixture
+def server(monkeypatch: pytest.MonkeyPatch) -> SimpleNamespace:
+    """
+    Record the requests made for translations.json, each of which is
+    answered by calling the next of the server's responses.
+    """
+    server = SimpleNamespace(requests=[], responses=[])
+
+    def fake_urlopen(request: Any) -> FakeResponse:
+        server.requests.append(request)
+        response: FakeResponse = server.responses.pop(0)()
+        return response
+
+    monkeypatch.setattr(usfm_checker, "urlopen", fake_urlopen)
+    monkeypatch.setattr(usfm_checker, "source_file_needs_update", lambda path: True)
+    return server
+
+
+def test_maybe_refresh_translations_skips_fresh_file(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Any
+) -> None:
+    monkeypatch.setattr(usfm_checker, "source_file_needs_update", lambda path: False)
+    monkeypatch.setattr(usfm_checker, "urlopen", fail)
+    assert usfm_checker._maybe_refresh_translations(
+        str(tmp_path), "http://example.com/translations.json"
+    ) == str(tmp_path / "translations.json")
+
+
+def not_modified() -> FakeResponse:
+    raise HTTPError(
+        "http://example.com/translations.json", 304, "Not Modified", Message(), None
+    )
+
+
+def test_maybe_refresh_translations_downloads_file(
+    tmp_path: Any, server: SimpleNamespace
+) -> None:
+    server.responses.append(lambda: FakeResponse(b"[]", {"ETag": '"abc"'}))
+    assert usfm_checker._maybe_refresh_translations(
+        str(tmp_path), "http://example.com/translations.json", buffer_size=1
+    ) == str(tmp_path / "translations.json")
+    assert server.requests[0].headers == {}
+    assert sorted(os.listdir(tmp_path)) == ["translations.etag", "translations.json"]
+    assert (tmp_path / "translations.json").read_text() == "[]"
+    assert (tmp_path / "translations.etag").read_text() == '"abc"'
+
+
+def test_maybe_refresh_translations_keeps_unchanged_file(
+    tmp_path: Any, server: SimpleNamespace
+) -> None:
+    (tmp_path / "translations.json").write_text("[]")
+    (tmp_path / "translations.etag").write_text('"abc"')
+    os.utime(tmp_path / "translations.json", (0, 0))
+    server.responses.append(not_modified)
+    usfm_checker._maybe_refresh_translations(
+        str(tmp_path), "http://example.com/translations.json"
+    )
+    # One conditional request rather than a HEAD request and a download
+    assert len(server.requests) == 1
+    assert server.requests[0].get_header("If-none-match") == '"abc"'
+    assert server.requests[0].get_header("If-modified-since") == (
+        "Thu, 01 Jan 1970 00:00:00 GMT"
+    )
+    assert (tmp_path / "translations.json").read_text() == "[]"
+    # The local copy is marked as fresh again
+    assert os.path.getmtime(tmp_path / "translations.json") > 0
+
+
+def test_maybe_refresh_translations_replaces_changed_file(
+    tmp_path: Any, server: SimpleNamespace
+) -> None:
+    (tmp_path / "translations.json").write_text("[]")
+    (tmp_path / "translations.etag").write_text('"abc"')
+    server.responses.append(lambda: FakeResponse(b"[{}]", {}))
+    usfm_checker._maybe_refresh_translations(
+        str(tmp_path), "http://example.com/translations.json"
+    )
+    assert os.listdir(tmp_path) == ["translations.json"]
+    assert (tmp_path / "translations.json").read_text() == "[{}]"
+
+
+def test_maybe_refresh_translations_falls_back_to_local_copy(
+    tmp_path: Any, server: SimpleNamespace
+) -> None:
+    def unreachable() -> FakeResponse:
+        raise URLError("Name or service not known")
+
+    server.responses.append(unreachable)
+    with pytest.raises(URLError):
+        usfm_checker._maybe_refresh_translations(
+            str(tmp_path), "http://example.com/translations.json"
+        )
+    (tmp_path / "translations.json").write_text("[]")
+    server.responses.append(unreachable)
+    assert usfm_checker._maybe_refresh_translations(
+        str(tmp_path), "http://example.com/translations.json"
+    ) == str(tmp_path / "translations.json")
+    assert (tmp_path / "translations.json").read_text() == "[]"
+
+
+def test_load_or_refresh_translations_index_reuses_pickle(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Any
+) -> None:
+    json_file = tmp_path / "translations.json"
+    json_file.write_text('[{"code": "aa", "contents": []}]')
+    monkeypatch.setattr(
+        usfm_checker, "_maybe_refresh_translations", lambda *args: str(json_file)
+    )
+    url = "http://example.com/translations.json"
+    index = usfm_checker._load_or_refresh_translations_index(str(tmp_path), url)
+    assert index == {"aa": {"code": "aa", "contents": []}}
+    # The pickle was built from this translations.json so it is used as is
+    with open(tmp_path / "translations.pickle", "rb") as fin:
+        signature, pickled_index = pickle.load(fin)
+    assert pickled_index == index
+    with open(tmp_path / "translations.pickle", "wb") as fout:
+        pickle.dump((signature, {"zz": {}}), fout)
+    assert usfm_checker._load_or_refresh_translations_index(str(tmp_path), url) == {
+        "zz": {}
+    }
+    # translations.json changed so the index is rebuilt
+    json_file.write_text('[{"code": "bb", "contents": []}]')
+    assert list(
+        usfm_checker._load_or_refresh_translations_index(str(tmp_path), url)
+    ) == ["bb"]
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_loads_json_with_or_without_orjson(
+    monkeypatch: pytest.MonkeyPatch, use_orjson: bool
+) -> None:
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(usfm_checker, "orjson", None)
+    content = '[{"code": "aa", "name": "Afar \u2013 Qafar af", "contents": []}]'
+    assert usfm_checker._loads_json(content.encode()) == [
+        {"code": "aa", "name": "Afar \u2013 Qafar af", "contents": []}
+    ]
+
+
+def test_write_atomically_removes_temp_file_on_failure(tmp_path: Any) -> None:
+    file_path = tmp_path / "translations.json"
+    file_path.write_text("[]")
+    with pytest.raises(KeyboardInterrupt):
+        with usfm_checker._write_atomically(str(file_path)) as fout:
+            fout.write(b"[{")
+            raise KeyboardInterrupt
+    assert os.listdir(tmp_path) == ["translations.json"]
+    assert file_path.read_text() == "[]"
+
+
+def test_resource_types_and_names_for_heart_lang_ignores_resource_type_order(
+    index: dict[str, Any],
+) -> None:
+    index["aa"] = {"code": "aa", "contents": [{"code": "ulb", "name": "ULB"}]}
+    resource_types_and_names = usfm_checker.resource_types_and_names_for_heart_lang
+    assert resource_types_and_names("aa", usfm_resource_types=["ulb", "f10"]) == (
+        ("ulb", "ULB (ulb)"),
+    )
+    assert resource_types_and_names("aa", usfm_resource_types=("f10", "ulb")) == (
+        ("ulb", "ULB (ulb)"),
+    )
+    cache_info = usfm_checker._resource_types_and_names_for_heart_lang.cache_info()
+    assert (cache_info.hits, cache_info.currsize) == (1, 1)